@@ -10,22 +10,53 @@ Features:
  - Prevents path traversal and symlink escape outside the root
  - Hidden files (dotfiles) are excluded from listings
  - Configurable bind address (default: 0.0.0.0)
+ - Raw PUT uploads streamed straight to disk for large files
+ - Optional download offload to a reverse proxy (X-Sendfile / X-Accel-Redirect)
 """
 
+import functools
+import io
 import logging
+import mimetypes
 import os
 import posixpath
+import re
+import shutil
+import stat
+import tempfile
 import argparse
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from urllib.parse import quote
 from flask import (
-    Flask, request, render_template_string, redirect,
-    url_for, flash, send_from_directory, abort
+    Flask, Request, Response, request, redirect,
+    url_for, send_file, abort
 )
+from itsdangerous import BadSignature, URLSafeSerializer
+from markupsafe import Markup, escape
 from werkzeug.utils import secure_filename
 
 logger = logging.getLogger(__name__)
 
 # Hidden/sensitive patterns to exclude from directory listings
 HIDDEN_PREFIXES = (".",)
+# Matches a hidden component anywhere in a '/'-separated relative path
+HIDDEN_PART_RE = re.compile(
+    r"(?:^|/)(?:" + "|".join(re.escape(p) for p in HIDDEN_PREFIXES) + ")"
+)
+
+# Read/write size used when streaming request bodies to disk
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+SENDFILE_CHUNK_SIZE = 1 << 30  # 1 GiB per sendfile(2) call
+# Multipart uploads larger than this are buffered in a temp file, not memory
+SPOOL_MAX_SIZE = 500 * 1024  # Werkzeug's default threshold
+
+# Runs durability work for finished uploads off the request thread
+_POST_UPLOAD_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="post-upload")
+
+# Characters left unquoted in URL paths, as Werkzeug's path converter does
+URL_SAFE = "!$&'()*+,/:;=@"
 
 # HTML template with directory navigation
 UPLOAD_PAGE = """
@@ -47,162 +78,441 @@ UPLOAD_PAGE = """
     {% if parent_path is not none %}
       <p><a href="{{ url_for('upload_file', path=parent_path) }}">⬆ Up</a></p>
     {% endif %}
-    {% with messages = get_flashed_messages() %}
-      {% if messages %}
-        <div class="messages">
-          <ul>
-          {% for msg in messages %}
-            <li>{{ msg }}</li>
-          {% endfor %}
-          </ul>
-        </div>
-      {% endif %}
-    {% endwith %}
+    {% if messages %}
+      <div class="messages">
+        <ul>
+        {% for msg in messages %}
+          <li>{{ msg }}</li>
+        {% endfor %}
+        </ul>
+      </div>
+    {% endif %}
     <form method="post" enctype="multipart/form-data" action="{{ url_for('upload_file', path=current_path) }}">
       <input type="file" name="file">
       <button type="submit">Upload to /{{ current_path }}</button>
     </form>
     <h2>Contents</h2>
     <ul class="items">
-      {% for dirname in dirs %}
-        <li><a class="dir" href="{{ url_for('upload_file', path=join_path(current_path, dirname)) }}">{{ dirname }}/</a></li>
-      {% endfor %}
-      {% for filename in files %}
-        <li><a href="{{ url_for('download_file', filename=join_path(current_path, filename)) }}">{{ filename }}</a></li>
-      {% endfor %}
+{{ items }}
     </ul>
   </body>
 </html>
 """
 
 
-def safe_join(base: str, *paths: str) -> str:
-    """Join and resolve (including symlinks), then ensure the result is inside base."""
-    # Resolve symlinks so a symlink pointing outside root is caught
-    resolved_base = os.path.realpath(base)
-    final = os.path.realpath(os.path.join(base, *paths))
-    # Ensure final path is the base itself or a child of it
-    if not (final == resolved_base or final.startswith(resolved_base + os.sep)):
+def _check_inside(base_prefix: str, path: str) -> str:
+    """Return path if it is base (base_prefix minus its separator) or below it."""
+    if not (path.startswith(base_prefix) or path == base_prefix[:-1]):
         raise ValueError("Attempt to access outside of root")
-    return final
+    return path
+
+
+def safe_join(base_prefix: str, *paths: str) -> str:
+    """Join and resolve (including symlinks), then ensure the result is inside base.
+
+    base_prefix is the already-resolved base with a trailing separator;
+    create_app precomputes it so nothing is re-resolved or rebuilt per request.
+    """
+    # Collapse ".." lexically; the normalized path is what gets opened
+    joined = _check_inside(base_prefix, os.path.normpath(os.path.join(base_prefix, *paths)))
+    # Only components below the resolved base can be symlinks, so lstat those
+    # instead of letting realpath walk the whole path on every request
+    current = base_prefix.rstrip(os.sep)
+    for part in joined[len(base_prefix):].split(os.sep):
+        if not part:
+            break
+        current += os.sep + part
+        try:
+            st = os.lstat(current)
+        except OSError:
+            break  # missing component: nothing below it exists either
+        # Windows junctions report S_IFDIR, so check for any reparse point too
+        if stat.S_ISLNK(st.st_mode) or getattr(st, 'st_reparse_tag', 0):
+            # Resolve links so one pointing outside root is caught
+            return _check_inside(base_prefix, os.path.realpath(joined))
+    return joined
 
 
 def _is_hidden(name: str) -> bool:
     """Return True if the entry name should be hidden from listings."""
-    return any(name.startswith(prefix) for prefix in HIDDEN_PREFIXES)
+    return name.startswith(HIDDEN_PREFIXES)
+
+
+_cached_secure_filename = functools.lru_cache(maxsize=4096)(secure_filename)
+
+
+def _secure_filename(name: str) -> str:
+    """secure_filename, memoized for clients that re-upload the same names."""
+    # Names come straight from the client; only cache ones of sane length
+    if len(name) > 255:
+        return secure_filename(name)
+    return _cached_secure_filename(name)
+
+
+def _render_items(dir_base: str, file_base: str, dirs, files) -> Markup:
+    """Render listing rows; dir_base/file_base are URL prefixes ending in '/'."""
+    # Locals avoid a global lookup per entry in the comprehensions below
+    esc, q, safe = escape, quote, URL_SAFE
+    rows = [
+        f'        <li><a class="dir" href="{esc(dir_base + q(name, safe))}">'
+        f'{esc(name)}/</a></li>'
+        for name in dirs
+    ]
+    rows += [
+        f'        <li><a href="{esc(file_base + q(name, safe))}">'
+        f'{esc(name)}</a></li>'
+        for name in files
+    ]
+    return Markup("\n".join(rows))
+
+
+def _sort_key(name: str) -> tuple:
+    """Sort key for listing entries: case-insensitive, then exact."""
+    return name.lower(), name
+
+
+def _list_dir(path: str) -> tuple:
+    """Return sorted (dirs, files) names in path, excluding hidden entries."""
+    dirs, files = [], []
+    # Bound once: this loop runs for every entry in the directory
+    is_hidden, add_dir, add_file = _is_hidden, dirs.append, files.append
+    # scandir reuses the d_type from readdir, so only symlinks need a stat
+    with os.scandir(path) as it:
+        for entry in it:
+            name = entry.name
+            if is_hidden(name):
+                continue
+            try:
+                if entry.is_dir():
+                    add_dir(name)
+                elif entry.is_file():
+                    add_file(name)
+            except OSError:
+                pass
+    # Case-insensitive order, ties broken by the exact name for stability
+    dirs.sort(key=_sort_key)
+    files.sort(key=_sort_key)
+    return dirs, files
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_list_dir(path: str, mtime_ns: int) -> tuple:
+    """Cache _list_dir keyed on the directory mtime.
+
+    Adding, removing or renaming an entry updates the directory's mtime,
+    so a changed directory misses the cache and is scanned again.
+    """
+    dirs, files = _list_dir(path)
+    return tuple(dirs), tuple(files)
+
+
+class UploadRequest(Request):
+    """Request that buffers multipart file parts in a BytesIO or a real file."""
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        # Werkzeug's default SpooledTemporaryFile only gains a descriptor by
+        # rolling over inside fileno(), and has no public way to ask whether
+        # it has; deciding up front lets _fileno rely on fileno() alone.
+        if total_content_length is None or total_content_length > SPOOL_MAX_SIZE:
+            return tempfile.TemporaryFile('w+b')
+        return io.BytesIO()
 
 
-def create_app(upload_root: str) -> Flask:
+def _fileno(stream) -> Optional[int]:
+    """Return the OS file descriptor behind stream, or None if it has none.
+
+    Never pass a SpooledTemporaryFile: fileno() would spill it to disk.
+    UploadRequest ensures upload streams are a BytesIO or a real file.
+    """
+    try:
+        return stream.fileno()
+    except (AttributeError, OSError):
+        return None
+
+
+def _sendfile_copy(out_fd: int, in_fd: int, offset: int) -> bool:
+    """Copy in_fd from offset to EOF into out_fd inside the kernel.
+
+    Returns False, having copied nothing, if sendfile(2) cannot write to a
+    regular file on this platform.
+    """
+    start = offset
+    while True:
+        try:
+            sent = os.sendfile(out_fd, in_fd, offset, SENDFILE_CHUNK_SIZE)
+        except OSError:
+            if offset == start:
+                return False
+            raise
+        if not sent:
+            return True
+        offset += sent
+
+
+def _stream_to_file(src, dest_path: str) -> int:
+    """Copy a stream into a new file, removing the partial file on failure.
+
+    Streams backed by a real file (e.g. the temp file UploadRequest uses
+    for large multipart uploads) are copied with sendfile(2).
+    Returns the size of the written file.
+    Raises FileExistsError if dest_path already exists.
+    """
+    with open(dest_path, 'xb') as out:
+        try:
+            src_fd = _fileno(src) if hasattr(os, 'sendfile') else None
+            if src_fd is None or not _sendfile_copy(out.fileno(), src_fd, src.tell()):
+                shutil.copyfileobj(src, out, UPLOAD_CHUNK_SIZE)
+            out.flush()
+            return os.fstat(out.fileno()).st_size
+        except BaseException:
+            out.close()
+            os.remove(dest_path)
+            raise
+
+
+def _post_upload(dest_path: str) -> None:
+    """Flush a finished upload and its directory entry to stable storage."""
+    try:
+        # No O_CREAT, so a file removed in the meantime is not recreated;
+        # Windows needs write access to flush, POSIX fsyncs a read-only fd
+        fd = os.open(dest_path, os.O_WRONLY if os.name == 'nt' else os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        if hasattr(os, 'O_DIRECTORY'):
+            dir_fd = os.open(os.path.dirname(dest_path), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+    except OSError:
+        logger.exception("Failed to sync %s", dest_path)
+
+
+def _content_disposition(name: str) -> str:
+    """Build an attachment Content-Disposition value, RFC 6266 encoded if non-ASCII."""
+    simple = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    value = 'attachment; filename="{}"'.format(simple.replace("\\", "\\\\").replace('"', '\\"'))
+    if simple != name:
+        value += "; filename*=UTF-8''" + quote(name, safe="!#$&+^`|~")
+    return value
+
+
+def create_app(upload_root: str, use_x_sendfile: bool = False,
+               accel_prefix: Optional[str] = None,
+               serve_downloads: bool = True) -> Flask:
     app = Flask(__name__)
+    app.request_class = UploadRequest
+    # Resolved once here; safe_join takes the separator-terminated form
     app.config['UPLOAD_FOLDER'] = os.path.realpath(upload_root)
-    app.config['MAX_CONTENT_LENGTH'] = 1024 ** 3  # 1 GiB
-    app.secret_key = os.urandom(24)
-
-    # Register a template helper for safe path joining
-    @app.context_processor
-    def utility_processor():
-        def join_path(base: str, name: str) -> str:
-            return posixpath.join(base, name).strip("/")
-        return {"join_path": join_path}
+    app.config['UPLOAD_FOLDER_SEP'] = os.path.join(app.config['UPLOAD_FOLDER'], "")
+    # Apache (mod_xsendfile) / lighttpd: send_file emits X-Sendfile
+    app.config['USE_X_SENDFILE'] = use_x_sendfile
+    # nginx: internal location prefix aliased to the upload root
+    app.config['X_ACCEL_PREFIX'] = accel_prefix.rstrip("/") + "/" if accel_prefix else None
+    # Checked against Content-Length before any of the body is read
+    app.config['MAX_UPLOAD_SIZE'] = 1024 ** 3  # 1 GiB
+    # Signs status messages carried in the query string; share FLASK_SECRET_KEY
+    # across workers so a message signed by one verifies in the others
+    app.secret_key = os.environ.get('FLASK_SECRET_KEY') or os.urandom(24)
+    message_signer = URLSafeSerializer(app.secret_key, salt='upload-message')
+
+    def redirect_with_message(path: str, message: str):
+        """Redirect to the listing of path, showing message there."""
+        return redirect(url_for('upload_file', path=path, msg=message_signer.dumps(message)))
+
+    @app.before_request
+    def limit_upload_size():
+        """Reject oversized uploads from the headers alone."""
+        if request.method not in ('POST', 'PUT'):
+            return None
+        length = request.content_length
+        if length is None:
+            # Chunked bodies have no declared size to check up front, and a
+            # raw PUT without one would otherwise store an empty file
+            if request.method == 'PUT' or 'Transfer-Encoding' in request.headers:
+                abort(411)
+        elif length > app.config['MAX_UPLOAD_SIZE']:
+            abort(413)
+        return None
+
+    # Compile the page once; url_for is available as an env global
+    upload_page = app.jinja_env.from_string(UPLOAD_PAGE)
 
     @app.route('/', methods=['GET', 'POST'])
     @app.route('/<path:path>', methods=['GET', 'POST'])
     def upload_file(path: str = "") -> str:
-        root = app.config['UPLOAD_FOLDER']
-
         # Normalize and verify path
         try:
-            current_dir = safe_join(root, path)
+            current_dir = safe_join(app.config['UPLOAD_FOLDER_SEP'], path)
         except ValueError:
             abort(404)
 
-        if not os.path.isdir(current_dir):
+        try:
+            dir_stat = os.stat(current_dir)
+        except OSError:
+            abort(404)
+
+        if not stat.S_ISDIR(dir_stat.st_mode):
             abort(404)
 
         if request.method == 'POST':
             if 'file' not in request.files:
-                flash('No file part in the request.')
-                return redirect(request.url)
+                return redirect_with_message(path, 'No file part in the request.')
             file = request.files['file']
             if not file or file.filename == '':
-                flash('No file selected for uploading.')
-                return redirect(request.url)
+                return redirect_with_message(path, 'No file selected for uploading.')
 
-            filename = secure_filename(file.filename)
+            filename = _secure_filename(file.filename)
             if not filename:
-                flash('Invalid filename.')
-                return redirect(request.url)
+                return redirect_with_message(path, 'Invalid filename.')
 
             # Prevent uploading hidden/dot files
             if _is_hidden(filename):
-                flash('Uploading hidden (dot) files is not allowed.')
-                return redirect(request.url)
+                return redirect_with_message(path, 'Uploading hidden (dot) files is not allowed.')
 
             dest_path = os.path.join(current_dir, filename)
 
             # Prevent overwriting existing files
             if os.path.exists(dest_path):
-                flash(f'File "{filename}" already exists. Rename it first.')
-                return redirect(url_for('upload_file', path=path))
+                return redirect_with_message(path, f'File "{filename}" already exists. Rename it first.')
 
             try:
-                file.save(dest_path)
+                _stream_to_file(file.stream, dest_path)
+                _POST_UPLOAD_POOL.submit(_post_upload, dest_path)
                 logger.info("Uploaded %s to %s", filename, path or "/")
-                flash(f'File "{filename}" uploaded successfully to /{path}')
+                message = f'File "{filename}" uploaded successfully to /{path}'
+            except FileExistsError:
+                message = f'File "{filename}" already exists. Rename it first.'
             except OSError:
                 logger.exception("Failed to save file %s", filename)
-                flash('Error saving file. Check server logs for details.')
+                message = 'Error saving file. Check server logs for details.'
 
-            return redirect(url_for('upload_file', path=path))
+            return redirect_with_message(path, message)
+
+        messages = []
+        token = request.args.get('msg')
+        if token:
+            try:
+                messages.append(message_signer.loads(token))
+            except BadSignature:
+                pass
 
         # Directory listing — exclude hidden entries
         try:
-            entries = os.listdir(current_dir)
-            dirs = sorted(
-                e for e in entries
-                if os.path.isdir(os.path.join(current_dir, e)) and not _is_hidden(e)
-            )
-            files = sorted(
-                e for e in entries
-                if os.path.isfile(os.path.join(current_dir, e)) and not _is_hidden(e)
-            )
+            dirs, files = _cached_list_dir(current_dir, dir_stat.st_mtime_ns)
         except OSError:
             logger.exception("Could not list directory %s", current_dir)
-            flash('Could not list directory.')
+            messages.append('Could not list directory.')
             dirs, files = [], []
 
         # Determine parent path
         parent_path = os.path.dirname(path) if path else None
 
-        return render_template_string(
-            UPLOAD_PAGE,
+        # Build each link by concatenation rather than one url_for per entry
+        rel = quote(path.strip("/"), safe=URL_SAFE)
+        rel = rel + "/" if rel else ""
+        dir_base = url_for('upload_file', path='_')[:-1] + rel
+        file_base = url_for('download_file', filename='_')[:-1] + rel
+
+        return upload_page.render(
             current_path=path,
             parent_path=parent_path,
-            dirs=dirs,
-            files=files,
+            messages=messages,
+            items=_render_items(dir_base, file_base, dirs, files),
         )
 
-    @app.route('/download/<path:filename>')
+    @app.route('/raw', methods=['PUT'])
+    @app.route('/raw/<path:path>', methods=['PUT'])
+    def upload_raw(path: str = ""):
+        """Write the request body to X-Filename without multipart parsing."""
+        try:
+            current_dir = safe_join(app.config['UPLOAD_FOLDER_SEP'], path)
+        except ValueError:
+            abort(404)
+
+        if not os.path.isdir(current_dir):
+            abort(404)
+
+        filename = _secure_filename(request.headers.get('X-Filename', ''))
+        if not filename:
+            return 'Missing or invalid X-Filename header.\n', 400
+
+        if _is_hidden(filename):
+            return 'Uploading hidden (dot) files is not allowed.\n', 403
+
+        dest_path = os.path.join(current_dir, filename)
+        try:
+            size = _stream_to_file(request.stream, dest_path)
+        except FileExistsError:
+            return f'File "{filename}" already exists. Rename it first.\n', 409
+        except OSError:
+            logger.exception("Failed to save file %s", filename)
+            return 'Error saving file. Check server logs for details.\n', 500
+
+        # Some servers (e.g. gunicorn) end the stream early on a client
+        # disconnect instead of raising, leaving a truncated file
+        if size != request.content_length:
+            os.remove(dest_path)
+            logger.warning("Incomplete upload of %s: got %d of %d bytes",
+                           filename, size, request.content_length)
+            return 'Upload incomplete: body shorter than Content-Length.\n', 400
+
+        _POST_UPLOAD_POOL.submit(_post_upload, dest_path)
+        logger.info("Uploaded %s to %s", filename, path or "/")
+        return f'File "{filename}" uploaded successfully to /{path}\n', 201
+
     def download_file(filename: str):
+        # Block downloading hidden files; checked first as it needs no syscalls
+        if HIDDEN_PART_RE.search(filename):
+            abort(404)
+
         root = app.config['UPLOAD_FOLDER']
         try:
-            resolved = safe_join(root, filename)
+            resolved = safe_join(app.config['UPLOAD_FOLDER_SEP'], filename)
         except ValueError:
             abort(404)
 
         if not os.path.isfile(resolved):
             abort(404)
 
-        # Block downloading hidden files
-        if any(_is_hidden(part) for part in filename.split("/")):
-            abort(404)
-
         logger.info("Download requested: %s", filename)
-        return send_from_directory(root, filename, as_attachment=True)
+
+        # Hand the transfer to nginx, which serves it with sendfile(2)
+        accel_prefix = app.config['X_ACCEL_PREFIX']
+        if accel_prefix:
+            relative = os.path.relpath(resolved, root).replace(os.sep, "/")
+            mimetype = mimetypes.guess_type(relative)[0] or 'application/octet-stream'
+            return Response(mimetype=mimetype, headers={
+                'X-Accel-Redirect': quote(accel_prefix + relative),
+                'Content-Disposition': _content_disposition(posixpath.basename(relative)),
+            })
+
+        # Conditional response: revalidation gets a 304, Range requests resume
+        response = send_file(resolved, as_attachment=True, conditional=True,
+                             etag=True, max_age=0)
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.must_revalidate = True
+        return response
+
+    if serve_downloads:
+        app.add_url_rule('/download/<path:filename>', view_func=download_file)
+    else:
+        # The reverse proxy serves /download/ itself; keep the rule for url_for
+        app.add_url_rule('/download/<path:filename>', endpoint='download_file',
+                         build_only=True)
 
     return app
 
 
+def _env_flag(name: str) -> bool:
+    """Interpret an environment variable as a boolean switch."""
+    return os.environ.get(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description='Python File Upload & Browser Server')
     parser.add_argument('-p', '--port', type=int, default=5000,
@@ -211,6 +521,17 @@ def main() -> None:
                         help='Address to bind to (default: 0.0.0.0)')
     parser.add_argument('-d', '--directory', default=os.getcwd(),
                         help='Root directory to serve (default: cwd)')
+    parser.add_argument('--x-sendfile', action='store_true',
+                        default=_env_flag('USE_X_SENDFILE'),
+                        help='Emit X-Sendfile headers for Apache/lighttpd '
+                             '(env: USE_X_SENDFILE)')
+    parser.add_argument('--x-accel-redirect', metavar='PREFIX',
+                        default=os.environ.get('X_ACCEL_REDIRECT') or None,
+                        help='Delegate downloads to an nginx internal location, '
+                             'e.g. /_protected/ (env: X_ACCEL_REDIRECT)')
+    parser.add_argument('--proxy-downloads', action='store_true',
+                        help='Do not serve /download/ from Python; the reverse '
+                             'proxy serves the files directly')
     args = parser.parse_args()
 
     if not os.path.isdir(args.directory):
@@ -221,9 +542,13 @@ def main() -> None:
         format='%(asctime)s [%(levelname)s] %(message)s',
     )
 
-    app = create_app(args.directory)
+    app = create_app(args.directory, use_x_sendfile=args.x_sendfile,
+                     accel_prefix=args.x_accel_redirect,
+                     serve_downloads=not args.proxy_downloads)
     logger.info("Serving %s on %s:%d", os.path.realpath(args.directory), args.bind, args.port)
-    app.run(host=args.bind, port=args.port)
+    # Handle each request in its own thread so a slow transfer does not
+    # block other clients; use a WSGI server such as gunicorn in production.
+    app.run(host=args.bind, port=args.port, threaded=True)
 
 
 if __name__ == '__main__':